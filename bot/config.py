@@ -1,11 +1,12 @@
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 from typing import List, Optional
 
 load_dotenv(override=False)
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     # Exchange / Market
     exchange: str                 # "bybit" (Binance deshabilitado por ahora)
@@ -42,7 +43,9 @@ class Config:
     api_secret: Optional[str]
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def from_env() -> "Config":
+        # El entorno se lee una sola vez por proceso; llamadas posteriores reutilizan la instancia
         exchange = os.getenv("EXCHANGE", "bybit").lower()
         # Por ahora sólo Bybit soportado
         if exchange != "bybit":
@@ -1,15 +1,43 @@
+import json
+import os
+import random
+import threading
 import time
-from typing import Any, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 import ccxt
+import requests
 
 from .logger import get_logger
 from .config import Config
 
 logger = get_logger("exchange")
 
+HEDGE_POSITION_MODES = frozenset({"hedge", "hedged", "hedging"})
+MARGIN_MODES = frozenset({"isolated", "cross"})
+
+# Caché en disco de los mercados (load_markets es la llamada más pesada del arranque)
+MARKETS_CACHE_DIR = ".run"
+MARKETS_CACHE_TTL_SECONDS = 12 * 3600
+
+# Reintentos: backoff exponencial con jitter; reconexión sólo ante fallos de red persistentes
+RETRY_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 0.25
+RETRY_CAP_SECONDS = 5.0
+RECONNECT_MIN_INTERVAL_SECONDS = 60
+
+# (decimales de cantidad, decimales de precio) si el mercado no está disponible
+DEFAULT_PRECISIONS = (6, 2)
+
+T = TypeVar("T")
+
 class ExchangeClient:
     def __init__(self, cfg: Config):
         self.cfg = cfg
+        # Precisiones por símbolo: inmutables durante la sesión
+        self._precisions: Dict[str, Tuple[int, int]] = {}
+        self._reconnect_lock = threading.Lock()
+        self._last_reconnect = 0.0
         self.exchange = self._build_exchange()
 
     def _build_exchange(self):
@@ -32,67 +60,126 @@ class ExchangeClient:
         if self.cfg.testnet:
             exchange.set_sandbox_mode(True)
 
-        logger.info(f"Exchange inicializado: {ex_name} | testnet={self.cfg.testnet} | type={self.cfg.market_type}")
+        logger.info("Exchange inicializado: %s | testnet=%s | type=%s", ex_name, self.cfg.testnet, self.cfg.market_type)
+
+        self._load_markets_cached(exchange)
 
         # Ajustes específicos de derivados (para cada símbolo configurado)
         self._setup_derivatives(exchange)
         return exchange
 
+    def _markets_cache_path(self) -> str:
+        network = "testnet" if self.cfg.testnet else "mainnet"
+        return os.path.join(MARKETS_CACHE_DIR, f"markets_{self.cfg.exchange}_{self.cfg.market_type}_{network}.json")
+
+    def _load_markets_cached(self, exchange):
+        path = self._markets_cache_path()
+        try:
+            if time.time() - os.path.getmtime(path) < MARKETS_CACHE_TTL_SECONDS:
+                with open(path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                exchange.set_markets(cached["markets"], cached.get("currencies"))
+                logger.info("Mercados cargados desde caché: %s", path)
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Caché de mercados inválida, se recarga: %s", e)
+
+        try:
+            markets = exchange.load_markets()
+            os.makedirs(MARKETS_CACHE_DIR, exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"markets": markets, "currencies": exchange.currencies}, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning("No se pudo cargar/cachear mercados: %s", e)
+
     def _setup_derivatives(self, exchange):
         # Position mode (global)
         try:
             pm = self.cfg.position_mode.lower()
-            hedged = pm in ("hedge", "hedged", "hedging")
+            hedged = pm in HEDGE_POSITION_MODES
             exchange.setPositionMode(hedged)
-            logger.info(f"Position mode configurado: {'hedged' if hedged else 'oneway'}")
+            logger.info("Position mode configurado: %s", "hedged" if hedged else "oneway")
         except Exception as e:
-            logger.warning(f"No se pudo configurar position mode: {e}")
+            logger.warning("No se pudo configurar position mode: %s", e)
 
-        # Por símbolo: leverage y margin mode
-        for sym in self.cfg.symbols:
-            try:
-                if self.cfg.leverage and self.cfg.leverage > 0:
-                    exchange.setLeverage(self.cfg.leverage, sym)
-                    logger.info(f"Leverage {self.cfg.leverage}x en {sym}")
-            except Exception as e:
-                logger.warning(f"No se pudo configurar leverage en {sym}: {e}")
+        # Por símbolo: leverage y margin mode (llamadas independientes, en paralelo)
+        symbols = self.cfg.symbols
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(symbols)))) as pool:
+            list(pool.map(lambda sym: self._setup_symbol(exchange, sym), symbols))
 
-            try:
-                mm = self.cfg.margin_mode.lower()
-                if mm in ("isolated", "cross"):
-                    exchange.setMarginMode(mm, sym)
-                    logger.info(f"Margin mode {mm} en {sym}")
-            except Exception as e:
-                logger.warning(f"No se pudo configurar margin mode en {sym}: {e}")
+    def _setup_symbol(self, exchange, sym: str):
+        try:
+            if self.cfg.leverage and self.cfg.leverage > 0:
+                exchange.setLeverage(self.cfg.leverage, sym)
+                logger.info("Leverage %sx en %s", self.cfg.leverage, sym)
+        except Exception as e:
+            logger.warning("No se pudo configurar leverage en %s: %s", sym, e)
 
-    def reconnect(self):
-        time.sleep(2)
-        self.exchange = self._build_exchange()
+        try:
+            mm = self.cfg.margin_mode.lower()
+            if mm in MARGIN_MODES:
+                exchange.setMarginMode(mm, sym)
+                logger.info("Margin mode %s en %s", mm, sym)
+        except Exception as e:
+            logger.warning("No se pudo configurar margin mode en %s: %s", sym, e)
 
-    def fetch_ticker_price(self, symbol: str) -> float:
-        for attempt in range(3):
+    def reconnect(self):
+        # Reset ligero: sólo se renueva la sesión HTTP. Leverage, margin/position mode y
+        # mercados siguen siendo válidos (estado del servidor), no hace falta reconstruir el cliente.
+        # La sesión anterior no se cierra: otros hilos del pool pueden tener peticiones en curso
+        # sobre ella. Se libera sola cuando terminan y deja de estar referenciada.
+        # trust_env se copia de ccxt (por defecto False): una sesión nueva de requests leería
+        # proxies, certificados y .netrc del entorno a mitad de ejecución.
+        session = requests.Session()
+        session.trust_env = self.exchange.requests_trust_env
+        self.exchange.session = session
+        logger.info("Sesión HTTP del exchange reiniciada")
+
+    def _maybe_reconnect(self):
+        # Varios hilos pueden fallar a la vez: sólo uno reconecta, y como mucho una vez por minuto
+        with self._reconnect_lock:
+            now = time.monotonic()
+            if now - self._last_reconnect < RECONNECT_MIN_INTERVAL_SECONDS:
+                return
+            self._last_reconnect = now
+            self.reconnect()
+
+    def _retry(self, name: str, fn: Callable[[], T], error_msg: str) -> T:
+        for attempt in range(RETRY_ATTEMPTS):
             try:
-                ticker = self.exchange.fetch_ticker(symbol)
-                return float(ticker["last"])
+                return fn()
             except ccxt.NetworkError as e:
-                logger.warning(f"Network error fetch_ticker: {e}, intento {attempt+1}/3")
-                self.reconnect()
+                logger.warning("Network error %s: %s, intento %s/%s", name, e, attempt + 1, RETRY_ATTEMPTS)
+                # Rate limit no se arregla reconectando; el resto sí si persiste
+                if attempt >= 1 and not isinstance(e, (ccxt.RateLimitExceeded, ccxt.DDoSProtection)):
+                    self._maybe_reconnect()
             except Exception as e:
-                logger.warning(f"Error fetch_ticker: {e}, intento {attempt+1}/3")
-                time.sleep(1)
-        raise RuntimeError("No se pudo obtener el precio tras varios intentos.")
+                logger.warning("Error %s: %s, intento %s/%s", name, e, attempt + 1, RETRY_ATTEMPTS)
+            if attempt < RETRY_ATTEMPTS - 1:
+                time.sleep(min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) + random.uniform(0, 0.1))
+        raise RuntimeError(error_msg)
 
-    def fetch_ohlcv(self, symbol: str, timeframe: str, limit: int = 200) -> List[List[Any]]:
-        for attempt in range(3):
-            try:
-                return self.exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
-            except ccxt.NetworkError as e:
-                logger.warning(f"Network error fetch_ohlcv: {e}, intento {attempt+1}/3")
-                self.reconnect()
-            except Exception as e:
-                logger.warning(f"Error fetch_ohlcv: {e}, intento {attempt+1}/3")
-                time.sleep(1)
-        raise RuntimeError("No se pudieron obtener OHLCV tras varios intentos.")
+    def fetch_ticker_price(self, symbol: str) -> float:
+        ticker = self._retry(
+            "fetch_ticker",
+            lambda: self.exchange.fetch_ticker(symbol),
+            "No se pudo obtener el precio tras varios intentos.",
+        )
+        return float(ticker["last"])
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str, limit: int = 200, since: Optional[int] = None) -> List[List[Any]]:
+        return self._retry(
+            "fetch_ohlcv",
+            lambda: self.exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit),
+            "No se pudieron obtener OHLCV tras varios intentos.",
+        )
+
+    def timeframe_seconds(self, timeframe: str) -> int:
+        return int(self.exchange.parse_timeframe(timeframe))
 
     def get_balance_usdt(self) -> float:
         try:
@@ -100,7 +187,7 @@ class ExchangeClient:
             total = bal.get("USDT", {}).get("free", 0.0) or 0.0
             return float(total)
         except Exception as e:
-            logger.warning(f"No se pudo obtener balance USDT: {e}")
+            logger.warning("No se pudo obtener balance USDT: %s", e)
             return 0.0
 
     def create_market_order(self, symbol: str, side: str, amount: float, *, reduce_only: bool = False) -> Dict[str, Any]:
@@ -108,27 +195,41 @@ class ExchangeClient:
         if reduce_only:
             params["reduceOnly"] = True
 
-        for attempt in range(3):
-            try:
-                order = self.exchange.create_order(symbol=symbol, type="market", side=side, amount=amount, params=params)
-                logger.info(f"Orden market: {side} {amount} {symbol} -> id={order.get('id')}, reduceOnly={reduce_only}")
-                return order
-            except ccxt.NetworkError as e:
-                logger.warning(f"Network error create_order: {e}, intento {attempt+1}/3")
-                self.reconnect()
-            except Exception as e:
-                logger.warning(f"Error create_order: {e}, intento {attempt+1}/3")
-                time.sleep(1)
-        raise RuntimeError("No se pudo crear la orden tras varios intentos.")
+        order = self._retry(
+            "create_order",
+            lambda: self.exchange.create_order(symbol=symbol, type="market", side=side, amount=amount, params=params),
+            "No se pudo crear la orden tras varios intentos.",
+        )
+        logger.info("Orden market: %s %s %s -> id=%s, reduceOnly=%s", side, amount, symbol, order.get("id"), reduce_only)
+        return order
 
     def get_symbol_precisions(self, symbol: str) -> Tuple[int, int]:
+        cached = self._precisions.get(symbol)
+        if cached is not None:
+            return cached
         try:
-            markets = self.exchange.load_markets()
+            # load_markets sólo va a la red si los mercados aún no están cargados
+            markets = self.exchange.markets or self.exchange.load_markets()
             market = markets.get(symbol)
             if not market:
-                return (6, 2)
+                return DEFAULT_PRECISIONS
             amount_prec = market.get("precision", {}).get("amount", 6)
             price_prec = market.get("precision", {}).get("price", 2)
-            return (int(amount_prec), int(price_prec))
+            precisions = (int(amount_prec), int(price_prec))
         except Exception:
-            return (6, 2)
+            return DEFAULT_PRECISIONS
+        self._precisions[symbol] = precisions
+        return precisions
+
+    def prefetch_precisions(self, symbols: List[str]) -> Dict[str, Tuple[int, int]]:
+        # Una sola carga de mercados para todos los símbolos, en lugar de resolverlos uno a uno.
+        # Sólo devuelve los resueltos: el fallback no se guarda para poder reintentarlo más tarde.
+        if not self.exchange.markets:
+            try:
+                self.exchange.load_markets()
+            except Exception as e:
+                logger.warning("No se pudieron cargar mercados para precisiones: %s", e)
+                return {}
+        for s in symbols:
+            self.get_symbol_precisions(s)
+        return {s: self._precisions[s] for s in symbols if s in self._precisions}
@@ -1,8 +1,20 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
+from functools import lru_cache
 
-def get_logger(name: str = "scalper"):
-    logger = logging.getLogger(name)
+# El formato no usa hilo ni proceso: evita recogerlos en cada LogRecord
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+# Logger base: único con handler; los de cada módulo ("scalper.runner", ...) propagan a él
+BASE_LOGGER = "scalper"
+
+def _configure_base() -> logging.Logger:
+    logger = logging.getLogger(BASE_LOGGER)
     if logger.handlers:
         return logger
 
@@ -13,5 +25,20 @@ def get_logger(name: str = "scalper"):
     ch.setFormatter(fmt)
     ch.setLevel(logging.INFO)
 
-    logger.addHandler(ch)
+    # La escritura en stdout se hace en un hilo aparte: los hilos de trading sólo encolan el registro
+    q = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, ch, respect_handler_level=True)
+    listener.start()
+    # Al salir se vacía la cola antes de terminar
+    atexit.register(listener.stop)
+
+    logger.addHandler(logging.handlers.QueueHandler(q))
+    logger.propagate = False
     return logger
+
+@lru_cache(maxsize=None)
+def get_logger(name: str = BASE_LOGGER):
+    base = _configure_base()
+    if name == BASE_LOGGER:
+        return base
+    return logging.getLogger(f"{BASE_LOGGER}.{name}")
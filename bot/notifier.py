@@ -1,49 +1,186 @@
+import html
+import queue
+import threading
+import time
 import requests
-from typing import Optional
+from typing import List, Optional
 from .logger import get_logger
 
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se usa la serialización de requests (json estándar)
+    orjson = None
+
 logger = get_logger("notifier")
 
+# Ventana de agrupado: los mensajes que llegan en ráfaga se envían en un solo POST
+BATCH_WINDOW_SECONDS = 0.5
+# Límite de longitud de un mensaje de Telegram
+MAX_MESSAGE_CHARS = 4096
+_SEPARATOR = "\n\n"
+# Cola acotada (se descarta lo más antiguo si se llena) y ritmo máximo de envío
+QUEUE_MAXSIZE = 1000
+MIN_POST_INTERVAL_SECONDS = 1 / 25
+POST_ATTEMPTS = 3
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# Como mucho un aviso de error cada N segundos; el resto se cuenta y se resume en el siguiente
+ERROR_MIN_INTERVAL_SECONDS = 30
+
+# Plantillas de mensajes
+_HEARTBEAT_MSG = "✅ Bot activo (heartbeat)"
+_OPEN_TMPL = (
+    "🟢 <b>Abrir operación</b>\n"
+    "Símbolo: {symbol}\n"
+    "Lado: {side}\n"
+    "Cantidad: {qty}\n"
+    "Entrada: {entry}\n"
+    "TP: {tp}\n"
+    "SL: {sl}"
+)
+_CLOSE_TMPL = (
+    "🔴 <b>Cerrar operación</b>\n"
+    "Símbolo: {symbol}\n"
+    "Lado cerrado: {side}\n"
+    "Cantidad: {qty}\n"
+    "Precio salida: {exit_price}\n"
+    "Motivo: {reason}"
+)
+_ERROR_TMPL = "⚠️ Error: {message}"
+_SUPPRESSED_TMPL = " (+{count} errores suprimidos)"
+
 class Notifier:
     def __init__(self, token: Optional[str], chat_id: Optional[str]):
         self.token = token
         self.chat_id = chat_id
+        self._url = f"https://api.telegram.org/bot{token}/sendMessage" if token else None
+        # Sesión reutilizable: mantiene la conexión HTTPS (keep-alive) entre mensajes
+        self._session = requests.Session()
+
+        # Envío en segundo plano: send() sólo encola y nunca bloquea el loop de trading
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=QUEUE_MAXSIZE)
+        self._next_post = 0.0
+        self._err_lock = threading.Lock()
+        self._err_last = float("-inf")
+        self._err_suppressed = 0
+        self._worker: Optional[threading.Thread] = None
+        if self.token and self.chat_id:
+            self._worker = threading.Thread(target=self._worker_loop, name="notifier", daemon=True)
+            self._worker.start()
 
     def send(self, text: str) -> None:
-        if not self.token or not self.chat_id:
-            logger.debug(f"[NO-TELEGRAM] {text}")
+        if self._worker is None:
+            logger.debug("[NO-TELEGRAM] %s", text)
+            return
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            logger.warning("Cola de Telegram llena, se descarta el mensaje más antiguo")
+            try:
+                self._queue.put_nowait(text)
+            except queue.Full:
+                pass
+
+    def close(self, timeout: float = 5.0) -> None:
+        # Envía lo pendiente y detiene el worker
+        if self._worker is None:
             return
-        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
         try:
-            resp = requests.post(url, json={"chat_id": self.chat_id, "text": text, "parse_mode": "HTML"}, timeout=10)
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+    def _worker_loop(self) -> None:
+        pending: Optional[str] = None
+        stopping = False
+        while not stopping:
+            first = pending if pending is not None else self._queue.get()
+            pending = None
+            if first is None:
+                break
+
+            batch: List[str] = [first]
+            size = len(first)
+            deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    text = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if text is None:
+                    stopping = True
+                    break
+                if size + len(_SEPARATOR) + len(text) > MAX_MESSAGE_CHARS:
+                    pending = text
+                    break
+                batch.append(text)
+                size += len(_SEPARATOR) + len(text)
+
+            self._post(_SEPARATOR.join(batch))
+
+    def _throttle(self) -> None:
+        # Sólo lo llama el worker: no necesita lock
+        wait = self._next_post - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_post = time.monotonic() + MIN_POST_INTERVAL_SECONDS
+
+    def _post(self, text: str) -> None:
+        payload = {"chat_id": self.chat_id, "text": text, "parse_mode": "HTML"}
+        for _ in range(POST_ATTEMPTS):
+            self._throttle()
+            try:
+                if orjson is not None:
+                    resp = self._session.post(self._url, data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=10)
+                else:
+                    resp = self._session.post(self._url, json=payload, timeout=10)
+            except Exception as e:
+                logger.warning("Error sending Telegram message: %s", e)
+                return
+            if resp.status_code == 429:
+                # Telegram indica cuánto esperar antes de reintentar
+                try:
+                    retry_after = float(resp.json()["parameters"]["retry_after"])
+                except Exception:
+                    retry_after = 1.0
+                logger.warning("Telegram rate limit, reintento en %ss", retry_after)
+                time.sleep(retry_after)
+                continue
             if resp.status_code != 200:
-                logger.warning(f"Telegram error {resp.status_code}: {resp.text}")
-        except Exception as e:
-            logger.warning(f"Error sending Telegram message: {e}")
+                logger.warning("Telegram error %s: %s", resp.status_code, resp.text)
+            return
+        logger.warning("Telegram rate limit persistente, se descarta el mensaje")
 
     def heartbeat(self) -> None:
-        self.send("✅ Bot activo (heartbeat)")
+        self.send(_HEARTBEAT_MSG)
 
     def trade_open(self, symbol: str, side: str, qty: float, entry: float, tp: float, sl: float) -> None:
-        self.send(
-            f"🟢 <b>Abrir operación</b>\n"
-            f"Símbolo: {symbol}\n"
-            f"Lado: {side}\n"
-            f"Cantidad: {qty}\n"
-            f"Entrada: {entry}\n"
-            f"TP: {tp}\n"
-            f"SL: {sl}"
-        )
+        self.send(_OPEN_TMPL.format(symbol=symbol, side=side, qty=qty, entry=entry, tp=tp, sl=sl))
 
     def trade_close(self, symbol: str, side: str, qty: float, exit_price: float, reason: str) -> None:
-        self.send(
-            f"🔴 <b>Cerrar operación</b>\n"
-            f"Símbolo: {symbol}\n"
-            f"Lado cerrado: {side}\n"
-            f"Cantidad: {qty}\n"
-            f"Precio salida: {exit_price}\n"
-            f"Motivo: {reason}"
-        )
+        self.send(_CLOSE_TMPL.format(symbol=symbol, side=side, qty=qty, exit_price=exit_price, reason=reason))
 
     def error(self, message: str) -> None:
-        self.send(f"⚠️ Error: {message}")
+        # Se llama desde varios hilos (un error por símbolo): durante una caída del exchange
+        # evita inundar Telegram con el mismo aviso
+        with self._err_lock:
+            now = time.monotonic()
+            if now - self._err_last < ERROR_MIN_INTERVAL_SECONDS:
+                self._err_suppressed += 1
+                return
+            suppressed = self._err_suppressed
+            self._err_last = now
+            self._err_suppressed = 0
+        # El texto del error es libre (p.ej. "'<=' not supported..."): se escapa para el parse_mode HTML,
+        # si no Telegram rechaza el lote entero en el que va agrupado
+        text = _ERROR_TMPL.format(message=html.escape(message))
+        if suppressed:
+            text += _SUPPRESSED_TMPL.format(count=suppressed)
+        self.send(text)
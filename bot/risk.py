@@ -1,12 +1,33 @@
-from math import floor
+from math import ceil, floor
+from typing import Tuple
+
+# Potencias de 10 precalculadas para las precisiones habituales de los mercados
+_POW10 = tuple(10 ** i for i in range(19))
+# Tolerancia (en ticks) al comparar precios con la rejilla de precisión
+_TICK_EPS = 1e-6
 
 def round_step(value: float, decimals: int) -> float:
-    factor = 10 ** decimals
-    return floor(value * factor) / factor
+    factor = _POW10[decimals] if 0 <= decimals < len(_POW10) else 10 ** decimals
+    # Truncado hacia abajo (valores no negativos: int() equivale a floor)
+    return int(value * factor) / factor
 
 def compute_futures_order_qty_usdt(max_notional_usdt: float, price: float, leverage: int, amount_decimals: int) -> float:
     if price <= 0 or leverage <= 0:
         return 0.0
     # notional = qty * price; qty = (max_notional_usdt * leverage) / price
     qty = (max_notional_usdt * leverage) / price
-    return round_step(qty, amount_decimals)
\ No newline at end of file
+    return round_step(qty, amount_decimals)
+
+def compute_tp_sl_prices(entry: float, tp_mul: float, sl_mul: float, sign: int, price_decimals: int) -> Tuple[float, float]:
+    # TP/SL al tick más cercano, pero siempre al menos un tick más allá de la entrada: con
+    # precisiones gruesas el redondeo podría dejarlos en la entrada o al otro lado. sign: 1 long, -1 short
+    factor = _POW10[price_decimals] if 0 <= price_decimals < len(_POW10) else 10 ** price_decimals
+    tp = round(entry * tp_mul, price_decimals)
+    sl = round(entry * sl_mul, price_decimals)
+    # Ticks estrictamente por encima/debajo de la entrada (el margen absorbe el error de coma flotante)
+    scaled = entry * factor
+    above = (floor(scaled + _TICK_EPS) + 1) / factor
+    below = (ceil(scaled - _TICK_EPS) - 1) / factor
+    if sign > 0:
+        return max(tp, above), min(sl, below)
+    return min(tp, below), max(sl, above)
@@ -2,18 +2,30 @@ import os
 import signal
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Tuple
 
 from .config import Config
-from .exchange import ExchangeClient
+from .exchange import DEFAULT_PRECISIONS, ExchangeClient
 from .logger import get_logger
 from .notifier import Notifier
-from .risk import compute_futures_order_qty_usdt
-from .strategy import SMAScalpingStrategy
+from .risk import compute_futures_order_qty_usdt, compute_tp_sl_prices
+from .strategy import SMAScalpingStrategy, SMAState
 
 logger = get_logger("runner")
 
+# Margen tras el cierre de vela para que el exchange ya la sirva como cerrada
+CANDLE_CLOSE_MARGIN_SECONDS = 0.2
+
+# Lado de la orden que cierra cada posición y lado de posición que abre cada señal
+_CLOSE_SIDE = {"long": "sell", "short": "buy"}
+_SIGNAL_SIDE = {"buy": "long", "sell": "short"}
+# Signo de la posición: TP/SL se evalúan igual para long y short multiplicando por él
+_SIDE_SIGN = {"long": 1, "short": -1}
+
 class Position:
+    __slots__ = ("side", "entry_price", "qty", "tp", "sl")
+
     def __init__(self):
         self.side: Optional[str] = None  # "long" | "short" | None
         self.entry_price: Optional[float] = None
@@ -46,154 +58,184 @@ class BotRunner:
         self.symbols = self.cfg.symbols
 
         # Estado por símbolo
-        self.strategies: Dict[str, SMAScalpingStrategy] = {
-            s: SMAScalpingStrategy(self.cfg.fast_sma, self.cfg.slow_sma) for s in self.symbols
-        }
+        self.strategy = SMAScalpingStrategy(self.cfg.fast_sma, self.cfg.slow_sma)
+        self.states: Dict[str, SMAState] = {s: self.strategy.new_state() for s in self.symbols}
         self.positions: Dict[str, Position] = {s: Position() for s in self.symbols}
+        # Precisiones de todos los símbolos de una vez al arrancar (constantes durante la sesión)
         self.precisions: Dict[str, Tuple[int, int]] = {}
+        self._store_precisions(self.ex.prefetch_precisions(self.symbols))
+
+        # Parámetros de entrada constantes durante toda la ejecución: (mult. TP, mult. SL) por lado
+        self._tp_sl_mul: Dict[str, Tuple[float, float]] = {
+            "long": (1 + self.cfg.tp_pct, 1 - self.cfg.sl_pct),
+            "short": (1 - self.cfg.tp_pct, 1 + self.cfg.sl_pct),
+        }
+        self._max_notional = self.cfg.max_notional_usdt
+        self._leverage = self.cfg.leverage
 
         self.timeframe = self.cfg.timeframe
+        self._ohlcv_limit = max(200, self.cfg.slow_sma + 5)
+        self._tf_seconds = self.ex.timeframe_seconds(self.timeframe)
+        self._tf_ms = self._tf_seconds * 1000
         self._stop = threading.Event()
+        # Los símbolos son independientes: se procesan en paralelo (acotado para respetar el rate limit)
+        self._pool = ThreadPoolExecutor(max_workers=min(8, len(self.symbols)), thread_name_prefix="symbol")
         self._pidfile = ".run/bot.pid"
         os.makedirs(".run", exist_ok=True)
 
     def _write_pid(self):
+        # Escritura atómica: stop.sh nunca ve un fichero a medio escribir
+        tmp = self._pidfile + ".tmp"
         try:
-            with open(self._pidfile, "w") as f:
-                f.write(str(os.getpid()))
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, str(os.getpid()).encode())
+            finally:
+                os.close(fd)
+            os.replace(tmp, self._pidfile)
         except Exception as e:
-            logger.warning(f"No se pudo escribir PID: {e}")
+            logger.warning("No se pudo escribir PID: %s", e)
 
     def _remove_pid(self):
         try:
-            if os.path.exists(self._pidfile):
-                os.remove(self._pidfile)
-        except Exception:
+            os.remove(self._pidfile)
+        except FileNotFoundError:
             pass
+        except Exception as e:
+            logger.warning("No se pudo borrar PID: %s", e)
 
     def _setup_signals(self):
         def handler(signum, frame):
-            logger.info(f"Recibida señal {signum}, cerrando...")
+            logger.info("Recibida señal %s, cerrando...", signum)
             self._stop.set()
         signal.signal(signal.SIGINT, handler)
         signal.signal(signal.SIGTERM, handler)
 
     def _heartbeat_loop(self):
         interval = max(1, self.cfg.heartbeat_minutes) * 60
-        next_ping = time.time()
-        while not self._stop.is_set():
-            now = time.time()
-            if now >= next_ping:
-                try:
-                    self.notifier.heartbeat()
-                except Exception as e:
-                    logger.warning(f"Heartbeat error: {e}")
-                next_ping = now + interval
-            self._stop.wait(5)
-
-    def _ensure_precisions(self, symbol: str):
-        if symbol not in self.precisions:
-            amt_dec, prc_dec = self.ex.get_symbol_precisions(symbol)
-            self.precisions[symbol] = (amt_dec, prc_dec)
-            logger.info(f"[{symbol}] precisión: amount_decimals={amt_dec}, price_decimals={prc_dec}")
+        # Primer latido al arrancar; después se duerme el intervalo completo (wait devuelve True al parar)
+        while True:
+            try:
+                self.notifier.heartbeat()
+            except Exception as e:
+                logger.warning("Heartbeat error: %s", e)
+            if self._stop.wait(interval):
+                break
+
+    def _store_precisions(self, resolved: Dict[str, Tuple[int, int]]):
+        for s, (amt_dec, prc_dec) in resolved.items():
+            self.precisions[s] = (amt_dec, prc_dec)
+            logger.info("[%s] precisión: amount_decimals=%s, price_decimals=%s", s, amt_dec, prc_dec)
+
+    def _ensure_precisions(self, symbol: str) -> Tuple[int, int]:
+        prec = self.precisions.get(symbol)
+        if prec is None:
+            # No se resolvieron al arrancar (p.ej. fallo al cargar mercados): se reintenta, y
+            # mientras tanto se usa el fallback sin guardarlo
+            resolved = self.ex.prefetch_precisions([symbol])
+            self._store_precisions(resolved)
+            prec = resolved.get(symbol, DEFAULT_PRECISIONS)
+        return prec
 
     def _handle_position(self, symbol: str, last_price: float):
         pos = self.positions[symbol]
         if not pos.is_open():
             return
-        if pos.side == "long":
-            if pos.tp and last_price >= pos.tp:
-                self.ex.create_market_order(symbol, "sell", pos.qty, reduce_only=True)
-                self.notifier.trade_close(symbol, "long", pos.qty, last_price, "take-profit")
-                logger.info(f"[{symbol}] TP long alcanzado a {last_price}")
-                pos.close()
-            elif pos.sl and last_price <= pos.sl:
-                self.ex.create_market_order(symbol, "sell", pos.qty, reduce_only=True)
-                self.notifier.trade_close(symbol, "long", pos.qty, last_price, "stop-loss")
-                logger.info(f"[{symbol}] SL long alcanzado a {last_price}")
-                pos.close()
+        sign = _SIDE_SIGN[pos.side]
+        if pos.tp and (last_price - pos.tp) * sign >= 0:
+            reason, label = "take-profit", "TP"
+        elif pos.sl and (pos.sl - last_price) * sign >= 0:
+            reason, label = "stop-loss", "SL"
+        else:
+            return
 
-        elif pos.side == "short":
-            if pos.tp and last_price <= pos.tp:
-                self.ex.create_market_order(symbol, "buy", pos.qty, reduce_only=True)
-                self.notifier.trade_close(symbol, "short", pos.qty, last_price, "take-profit")
-                logger.info(f"[{symbol}] TP short alcanzado a {last_price}")
-                pos.close()
-            elif pos.sl and last_price >= pos.sl:
-                self.ex.create_market_order(symbol, "buy", pos.qty, reduce_only=True)
-                self.notifier.trade_close(symbol, "short", pos.qty, last_price, "stop-loss")
-                logger.info(f"[{symbol}] SL short alcanzado a {last_price}")
-                pos.close()
+        side = pos.side
+        self.ex.create_market_order(symbol, _CLOSE_SIDE[side], pos.qty, reduce_only=True)
+        self.notifier.trade_close(symbol, side, pos.qty, last_price, reason)
+        logger.info("[%s] %s %s alcanzado a %s", symbol, label, side, last_price)
+        pos.close()
 
     def _maybe_enter(self, symbol: str, sig: Optional[str], last_price: float):
-        strat = self.strategies[symbol]
+        if sig is None:
+            return
         pos = self.positions[symbol]
-        amt_dec, prc_dec = self.precisions[symbol]
-
-        if sig == "buy":
-            if pos.is_open():
-                if pos.side == "short":
-                    self.ex.create_market_order(symbol, "buy", pos.qty, reduce_only=True)
-                    self.notifier.trade_close(symbol, "short", pos.qty, last_price, "señal contraria")
-                    logger.info(f"[{symbol}] Cerramos short por señal contraria a {last_price}")
-                    pos.close()
-            else:
-                qty = compute_futures_order_qty_usdt(self.cfg.max_notional_usdt, last_price, self.cfg.leverage, amt_dec)
-                if qty > 0:
-                    self.ex.create_market_order(symbol, "buy", qty, reduce_only=False)
-                    entry = last_price
-                    tp = round(entry * (1 + self.cfg.tp_pct), prc_dec)
-                    sl = round(entry * (1 - self.cfg.sl_pct), prc_dec)
-                    pos.open("long", entry, qty, tp, sl)
-                    self.notifier.trade_open(symbol, "long", qty, entry, tp, sl)
-                    logger.info(f"[{symbol}] Abrimos long: qty={qty} entry={entry} tp={tp} sl={sl}")
-
-        elif sig == "sell":
-            if pos.is_open():
-                if pos.side == "long":
-                    self.ex.create_market_order(symbol, "sell", pos.qty, reduce_only=True)
-                    self.notifier.trade_close(symbol, "long", pos.qty, last_price, "señal contraria")
-                    logger.info(f"[{symbol}] Cerramos long por señal contraria a {last_price}")
-                    pos.close()
+        amt_dec, prc_dec = self._ensure_precisions(symbol)
+        side = _SIGNAL_SIDE[sig]
+
+        if pos.is_open():
+            if pos.side != side:
+                held = pos.side
+                self.ex.create_market_order(symbol, _CLOSE_SIDE[held], pos.qty, reduce_only=True)
+                self.notifier.trade_close(symbol, held, pos.qty, last_price, "señal contraria")
+                logger.info("[%s] Cerramos %s por señal contraria a %s", symbol, held, last_price)
+                pos.close()
+
+        else:
+            qty = compute_futures_order_qty_usdt(self._max_notional, last_price, self._leverage, amt_dec)
+            if qty > 0:
+                self.ex.create_market_order(symbol, sig, qty, reduce_only=False)
+                entry = last_price
+                tp_mul, sl_mul = self._tp_sl_mul[side]
+                tp, sl = compute_tp_sl_prices(entry, tp_mul, sl_mul, _SIDE_SIGN[side], prc_dec)
+                pos.open(side, entry, qty, tp, sl)
+                self.notifier.trade_open(symbol, side, qty, entry, tp, sl)
+                logger.info("[%s] Abrimos %s: qty=%s entry=%s tp=%s sl=%s", symbol, side, qty, entry, tp, sl)
+
+    def _process_symbol(self, symbol: str):
+        if self._stop.is_set():
+            return
+        try:
+            state = self.states[symbol]
+            # La vela en formación cierra en last_closed_ts + 2 * timeframe. Hasta entonces no hay
+            # velas nuevas que descargar: basta con el último precio (ticker, payload más pequeño).
+            now_ms = time.time() * 1000
+            if state.last_closed_ts is not None and now_ms < state.last_closed_ts + 2 * self._tf_ms:
+                last_price = self.ex.fetch_ticker_price(symbol)
+                sig = self.strategy.signal_at(state, last_price)
             else:
-                qty = compute_futures_order_qty_usdt(self.cfg.max_notional_usdt, last_price, self.cfg.leverage, amt_dec)
-                if qty > 0:
-                    self.ex.create_market_order(symbol, "sell", qty, reduce_only=False)
-                    entry = last_price
-                    tp = round(entry * (1 - self.cfg.tp_pct), prc_dec)
-                    sl = round(entry * (1 + self.cfg.sl_pct), prc_dec)
-                    pos.open("short", entry, qty, tp, sl)
-                    self.notifier.trade_open(symbol, "short", qty, entry, tp, sl)
-                    logger.info(f"[{symbol}] Abrimos short: qty={qty} entry={entry} tp={tp} sl={sl}")
+                # Tras el arranque sólo se piden las velas desde la última cerrada ya procesada
+                ohlcv = self.ex.fetch_ohlcv(symbol, self.timeframe, limit=self._ohlcv_limit, since=state.last_closed_ts)
+                if state.last_closed_ts is not None and len(ohlcv) >= self._ohlcv_limit:
+                    # Lote completo: el hueco puede ser mayor que `limit` (p.ej. tras una caída) y `since`
+                    # devuelve las velas más antiguas, sin llegar a la vela en formación. Se resiembra
+                    # con las más recientes.
+                    ohlcv = self.ex.fetch_ohlcv(symbol, self.timeframe, limit=self._ohlcv_limit)
+                sig = self.strategy.signal(state, ohlcv)
+                last_price = float(ohlcv[-1][4])
+
+            self._handle_position(symbol, last_price)
+            self._maybe_enter(symbol, sig, last_price)
+
+        except Exception as e:
+            logger.warning("[%s] Error en loop: %s", symbol, e)
+            self.notifier.error(f"{symbol}: {e}")
+            time.sleep(1)  # backoff ligero por símbolo
 
     def _trading_loop(self):
         poll = max(2, self.cfg.poll_interval_seconds)
-
-        while not self._stop.is_set():
-            cycle_start = time.time()
-            for symbol in self.symbols:
-                if self._stop.is_set():
-                    break
-                try:
-                    self._ensure_precisions(symbol)
-                    ohlcv = self.ex.fetch_ohlcv(symbol, self.timeframe, limit=max(200, self.cfg.slow_sma + 5))
-                    closes = [float(c[4]) for c in ohlcv]
-
-                    sig = self.strategies[symbol].signal(closes)
-                    last_price = closes[-1]
-
-                    self._handle_position(symbol, last_price)
-                    self._maybe_enter(symbol, sig, last_price)
-
-                except Exception as e:
-                    logger.warning(f"[{symbol}] Error en loop: {e}")
-                    self.notifier.error(f"{symbol}: {e}")
-                    time.sleep(1)  # backoff ligero por símbolo
-
-            # Espera hasta completar el intervalo de polling
-            elapsed = time.time() - cycle_start
-            wait_for = max(0, poll - elapsed)
-            self._stop.wait(wait_for)
+        # Referencias locales: se resuelven una vez en lugar de en cada ciclo
+        symbols = self.symbols
+        process = self._process_symbol
+        pool_map = self._pool.map
+        stop_is_set = self._stop.is_set
+        stop_wait = self._stop.wait
+        tf_seconds = self._tf_seconds
+
+        # Plazos sobre reloj monotónico: sin deriva acumulada ni saltos por ajustes de hora
+        deadline = time.monotonic() + poll
+        while not stop_is_set():
+            # Las peticiones REST de cada símbolo se solapan; el ciclo dura ~max() en lugar de sum()
+            list(pool_map(process, symbols))
+
+            now = time.monotonic()
+            if now >= deadline:
+                # Si el ciclo se pasó del plazo se salta al siguiente límite, sin encadenar ciclos
+                deadline += poll * ((now - deadline) // poll + 1)
+
+            # Espera hasta el siguiente plazo, pero despierta justo tras el cierre de la vela en
+            # curso para procesarla sin esperar al siguiente poll (las velas se alinean a la hora real)
+            until_close = tf_seconds - (time.time() % tf_seconds) + CANDLE_CLOSE_MARGIN_SECONDS
+            stop_wait(min(deadline - now, until_close))
 
     def run(self):
         logger.info("Iniciando bot (Bybit derivados, multi-símbolo)...")
@@ -206,5 +248,7 @@ class BotRunner:
         try:
             self._trading_loop()
         finally:
+            self._pool.shutdown(wait=True)
+            self.notifier.close()
             self._remove_pid()
             logger.info("Bot detenido.")
@@ -1,37 +1,78 @@
-from typing import Literal, Optional, Sequence
-import statistics
+from collections import deque
+from typing import Deque, List, Literal, Optional, Sequence
 
 Signal = Optional[Literal["buy", "sell"]]
 
-def sma(values: Sequence[float], period: int) -> float:
-    if len(values) < period:
-        raise ValueError("No hay suficientes datos para la SMA")
-    return statistics.fmean(values[-period:])
+class SMAState:
+    # Estado incremental de un símbolo: ventanas de velas cerradas con su suma acumulada
+    __slots__ = ("fast_win", "slow_win", "fast_sum", "slow_sum", "last_closed_ts", "last_fast", "last_slow")
+
+    def __init__(self, fast: int, slow: int):
+        self.fast_win: Deque[float] = deque(maxlen=fast)
+        self.slow_win: Deque[float] = deque(maxlen=slow)
+        self.fast_sum = 0.0
+        self.slow_sum = 0.0
+        self.last_closed_ts: Optional[int] = None
+        self.last_fast: Optional[float] = None
+        self.last_slow: Optional[float] = None
 
 class SMAScalpingStrategy:
+    # Sólo parámetros: una instancia se comparte entre símbolos, cada uno con su SMAState
     def __init__(self, fast: int, slow: int):
         if fast >= slow:
             raise ValueError("FAST_SMA debe ser menor que SLOW_SMA")
         self.fast = fast
         self.slow = slow
-        self._last_fast = None
-        self._last_slow = None
 
-    def signal(self, closes: list[float]) -> Signal:
-        if len(closes) < self.slow + 1:
+    def new_state(self) -> SMAState:
+        return SMAState(self.fast, self.slow)
+
+    def _push_closed(self, state: SMAState, close: float):
+        if len(state.fast_win) == self.fast:
+            state.fast_sum -= state.fast_win[0]
+        state.fast_win.append(close)
+        state.fast_sum += close
+
+        if len(state.slow_win) == self.slow:
+            state.slow_sum -= state.slow_win[0]
+        state.slow_win.append(close)
+        state.slow_sum += close
+
+    def update(self, state: SMAState, ohlcv: Sequence[List[float]]):
+        # ohlcv en orden cronológico; la última vela es la que está en formación.
+        # Sólo se incorporan a las ventanas las velas cerradas que aún no se habían visto,
+        # así que basta con pasar las velas nuevas (fetch con `since=state.last_closed_ts`).
+        for candle in ohlcv[:-1]:
+            ts = candle[0]
+            if state.last_closed_ts is not None and ts <= state.last_closed_ts:
+                continue
+            self._push_closed(state, float(candle[4]))
+            state.last_closed_ts = ts
+
+    def signal_at(self, state: SMAState, price: float) -> Signal:
+        # Señal con `price` como cierre provisional de la vela en formación
+        if len(state.slow_win) < self.slow:
             return None
-        fast_now = sma(closes, self.fast)
-        slow_now = sma(closes, self.slow)
+
+        # SMA actual = últimas (period - 1) velas cerradas + precio de la vela en formación
+        fast_now = (state.fast_sum - state.fast_win[0] + price) / self.fast
+        slow_now = (state.slow_sum - state.slow_win[0] + price) / self.slow
 
         sig: Signal = None
-        if self._last_fast is not None and self._last_slow is not None:
-            crossed_up = self._last_fast <= self._last_slow and fast_now > slow_now
-            crossed_down = self._last_fast >= self._last_slow and fast_now < slow_now
+        if state.last_fast is not None and state.last_slow is not None:
+            crossed_up = state.last_fast <= state.last_slow and fast_now > slow_now
+            crossed_down = state.last_fast >= state.last_slow and fast_now < slow_now
             if crossed_up:
                 sig = "buy"
             elif crossed_down:
                 sig = "sell"
 
-        self._last_fast = fast_now
-        self._last_slow = slow_now
+        state.last_fast = fast_now
+        state.last_slow = slow_now
         return sig
+
+    def signal(self, state: SMAState, ohlcv: Sequence[List[float]]) -> Signal:
+        if not ohlcv:
+            return None
+        self.update(state, ohlcv)
+        return self.signal_at(state, float(ohlcv[-1][4]))